@@ -1,23 +1,156 @@
 #!/usr/bin/env python3
 import os
 import sys
+import io
+import errno
+import re
 import shutil
-import json
+import orjson
 import argparse
+import array
 import logging
-import subprocess
-import shlex
+from concurrent.futures import Future, ThreadPoolExecutor
+from itertools import chain
+
+logger = logging.getLogger(__name__)
 
 class OperationError(Exception):
     """Custom exception for operation errors."""
     pass
 
+# Rollback opcodes, stored one byte per record in PlanExecutor._op
+OP_RMDIR = 0
+OP_MOVE = 1
+OP_RENAME = 2
+
+# Usage string reported for each plan command when its argument count is wrong
+PLAN_USAGE = {
+    "MKDIR": 'MKDIR "<dir>"',
+    "MOVE": 'MOVE "<src>" "<dst>"',
+    "RENAME": 'RENAME "<old>" "<new>"',
+}
+
+# shlex.split only treats these as whitespace; bare tokens are everything else
+_SHELL_SPACE = " \t\r\n"
+_BARE_TOKEN = re.compile(r"[^ \t\r\n]+")
+
+def _split_quoted(line):
+    """Tokenize a line containing quotes or backslashes with shlex.split's POSIX rules."""
+    tokens = []
+    token = []
+    in_token = False
+    i = 0
+    n = len(line)
+    while i < n:
+        c = line[i]
+        if c in _SHELL_SPACE:
+            if in_token:
+                tokens.append("".join(token))
+                token = []
+                in_token = False
+            i += 1
+            continue
+        in_token = True
+        if c == "\\":
+            if i + 1 >= n:
+                raise OperationError(f"Error parsing line: {line}. No escaped character")
+            token.append(line[i + 1])
+            i += 2
+        elif c == "'":
+            # Nothing is escaped inside single quotes
+            end = line.find("'", i + 1)
+            if end == -1:
+                raise OperationError(f"Error parsing line: {line}. No closing quotation")
+            token.append(line[i + 1:end])
+            i = end + 1
+        elif c == '"':
+            # Inside double quotes a backslash only escapes \" and \\
+            i += 1
+            while True:
+                if i >= n:
+                    raise OperationError(f"Error parsing line: {line}. No closing quotation")
+                c = line[i]
+                if c == '"':
+                    i += 1
+                    break
+                if c == "\\" and i + 1 < n and line[i + 1] in '"\\':
+                    i += 1
+                    c = line[i]
+                token.append(c)
+                i += 1
+        else:
+            token.append(c)
+            i += 1
+    if in_token:
+        tokens.append("".join(token))
+    return tokens
+
+def _parse_plan_line(line):
+    """Split a plan line into (COMMAND, args) following the same quoting rules as shlex.split."""
+    if '"' in line or "'" in line or "\\" in line:
+        tokens = _split_quoted(line)
+    else:
+        tokens = _BARE_TOKEN.findall(line)
+    return tokens[0].upper(), tokens[1:]
+
+def _replace(src, dst):
+    """Move src to dst with shutil.move semantics, using a single os.replace when that is equivalent.
+
+    Returns the path src actually ended up at.
+    """
+    # os.replace would silently overwrite an empty directory at dst; shutil.move nests into it
+    if os.path.isdir(dst):
+        return shutil.move(src, dst)
+    try:
+        os.replace(src, dst)
+    except OSError as e:
+        # Cross-device, or dst turned into a directory after the check above
+        if e.errno not in (errno.EXDEV, errno.EISDIR, errno.ENOTEMPTY, errno.EEXIST):
+            raise
+        return shutil.move(src, dst)
+    return dst
+
+def _walk(root):
+    """Yield (path, is_dir) for everything under root, listing .app bundles but not their contents."""
+    with os.scandir(root) as it:
+        for entry in it:
+            if entry.is_dir(follow_symlinks=False):
+                yield entry.path, True
+                # .app bundles are listed as a single entry, like find's -prune
+                if not entry.name.endswith(".app"):
+                    yield from _walk(entry.path)
+            else:
+                yield entry.path, entry.is_dir()
+
+def _walk_parallel(root, max_workers=8):
+    """Same listing as _walk, but each top-level directory is walked on its own thread."""
+    parts = []
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        with os.scandir(root) as it:
+            for entry in it:
+                if entry.is_dir(follow_symlinks=False):
+                    parts.append([(entry.path, True)])
+                    if not entry.name.endswith(".app"):
+                        parts.append(pool.submit(list, _walk(entry.path)))
+                else:
+                    parts.append([(entry.path, entry.is_dir())])
+    # Futures are resolved in submission order, so the output order matches _walk
+    return chain.from_iterable(p.result() if isinstance(p, Future) else p for p in parts)
+
 class PlanExecutor:
     def __init__(self, desktop_dir, plan_file, rollback_file=".rollbackinfo.json"):
         self.desktop_dir = os.path.abspath(desktop_dir)
+        self._prefix = self.desktop_dir + os.sep
         self.plan_file = plan_file
-        self.rollback_file = os.path.join(self.desktop_dir, rollback_file)
-        self.rollback_commands = []
+        self.rollback_file = self._abs(rollback_file)
+        # Rollback log kept column-wise: an opcode byte plus one or two relative paths
+        self._op = array.array('B')
+        self._a1 = []
+        self._a2 = []
+        # Column appends bound once so the per-command handlers skip the attribute lookups
+        self._op_append = self._op.append
+        self._a1_append = self._a1.append
+        self._a2_append = self._a2.append
 
         # Check desktop directory
         if not os.path.isdir(self.desktop_dir):
@@ -26,173 +159,207 @@ class PlanExecutor:
             raise OperationError(f"No write permission on desktop directory: {self.desktop_dir}")
 
     def _is_within_desktop(self, path):
-        abs_path = os.path.abspath(path)
-        return abs_path.startswith(self.desktop_dir + os.sep)
+        # Paths are always joined onto the absolute desktop_dir, so normpath is
+        # enough to collapse ".." without abspath's getcwd() call.
+        return os.path.normpath(path).startswith(self._prefix)
+
+    def _abs(self, rel_path):
+        # Same result as os.path.join(self.desktop_dir, rel_path), minus the call overhead
+        return rel_path if rel_path.startswith(os.sep) else self._prefix + rel_path
 
     def _mkdir(self, rel_path):
-        target_dir = os.path.join(self.desktop_dir, rel_path)
+        target_dir = self._abs(rel_path)
         if not self._is_within_desktop(target_dir):
             raise OperationError("Attempt to create directory outside of desktop.")
         if not os.path.exists(target_dir):
-            # logging.info(f"Creating directory: {target_dir}")
+            # logger.info("Creating directory: %s", target_dir)
             os.makedirs(target_dir, exist_ok=True)
             # Rollback: remove this directory
-            self.rollback_commands.append(("RMDIR", rel_path))
+            self._op_append(OP_RMDIR)
+            self._a1_append(rel_path)
+            self._a2_append("")
         else:
-            logging.info(f"Directory already exists: {target_dir}, skipping.")
+            logger.info("Directory already exists: %s, skipping.", target_dir)
 
     def _move(self, src_rel, dst_rel):
-        src = os.path.join(self.desktop_dir, src_rel)
-        dst = os.path.join(self.desktop_dir, dst_rel)
-        if not (self._is_within_desktop(src) and self._is_within_desktop(dst)):
+        # Normalized up front so the rollback paths below can be sliced off the prefix
+        src = os.path.normpath(self._abs(src_rel))
+        dst = os.path.normpath(self._abs(dst_rel))
+        prefix = self._prefix
+        if not (src.startswith(prefix) and dst.startswith(prefix)):
             raise OperationError("Attempt to move outside desktop.")
-        if not os.path.exists(src):
-            raise OperationError(f"Source file/folder does not exist for MOVE: {src}")
 
         if os.path.isdir(dst):
-            new_path = os.path.join(dst, os.path.basename(src))
+            new_path = dst + os.sep + src.rpartition(os.sep)[2]
         else:
             new_path = dst
 
-        # logging.info(f"Moving from {src} to {new_path}")
+        # logger.info("Moving from %s to %s", src, new_path)
         old_path = src
-        shutil.move(src, new_path)
-        relative_new_path = os.path.relpath(new_path, self.desktop_dir)
-        relative_old_path = os.path.relpath(old_path, self.desktop_dir)
-        self.rollback_commands.append(("MOVE", relative_new_path, relative_old_path))
+        try:
+            new_path = _replace(src, new_path)
+        except FileNotFoundError:
+            # The rename reports ENOENT for a missing source or a missing destination parent
+            if not os.path.lexists(src):
+                raise OperationError(f"Source file/folder does not exist for MOVE: {src}")
+            raise
+        relative_new_path = new_path[len(prefix):]
+        relative_old_path = old_path[len(prefix):]
+        self._op_append(OP_MOVE)
+        self._a1_append(relative_new_path)
+        self._a2_append(relative_old_path)
 
     def _rename(self, old_rel, new_rel):
-        old_path = os.path.join(self.desktop_dir, old_rel)
-        new_path = os.path.join(self.desktop_dir, new_rel)
+        old_path = self._abs(old_rel)
+        new_path = self._abs(new_rel)
         if not (self._is_within_desktop(old_path) and self._is_within_desktop(new_path)):
             raise OperationError("Attempt to rename outside desktop.")
-        if not os.path.exists(old_path):
-            raise OperationError(f"Old name does not exist for RENAME: {old_path}")
 
-        # logging.info(f"Renaming {old_path} to {new_path}")
-        os.rename(old_path, new_path)
-        self.rollback_commands.append(("RENAME", new_rel, old_rel))
+        # logger.info("Renaming %s to %s", old_path, new_path)
+        try:
+            os.rename(old_path, new_path)
+        except FileNotFoundError:
+            if not os.path.lexists(old_path):
+                raise OperationError(f"Old name does not exist for RENAME: {old_path}")
+            raise
+        self._op_append(OP_RENAME)
+        self._a1_append(new_rel)
+        self._a2_append(old_rel)
+
+    # Plan command -> (handler function, expected argument count); handlers are called as fn(self, *args)
+    _DISPATCH = {
+        "MKDIR": (_mkdir, 1),
+        "MOVE": (_move, 2),
+        "RENAME": (_rename, 2),
+    }
 
     def execute_plan(self):
         if not os.path.isfile(self.plan_file):
             raise OperationError(f"Plan file does not exist: {self.plan_file}")
 
-        logging.info(f"Executing plan: {self.plan_file}")
-        with open(self.plan_file, 'r', encoding='utf-8') as f:
-            for line in f:
-                line = line.strip()
-                if not line or line.startswith("#"):
-                    continue
-                try:
-                    parts = shlex.split(line)
-                except ValueError as e:
-                    raise OperationError(f"Error parsing line: {line}. {e}")
-
-                if not parts:
-                    continue
-
-                cmd = parts[0].upper()
-                try:
-                    if cmd == "MKDIR":
-                        if len(parts) != 2:
-                            raise OperationError("Invalid MKDIR syntax. Usage: MKDIR \"<dir>\"")
-                        self._mkdir(parts[1])
-
-                    elif cmd == "MOVE":
-                        if len(parts) != 3:
-                            raise OperationError("Invalid MOVE syntax. Usage: MOVE \"<src>\" \"<dst>\"")
-                        self._move(parts[1], parts[2])
-
-                    elif cmd == "RENAME":
-                        if len(parts) != 3:
-                            raise OperationError("Invalid RENAME syntax. Usage: RENAME \"<old>\" \"<new>\"")
-                        self._rename(parts[1], parts[2])
-
-                    else:
-                        raise OperationError(f"Unknown command: {cmd}")
-                except OperationError as e:
-                    logging.error(f"Error encountered: {e}")
-                    continue
-                except Exception as e:
-                    logging.exception(f"Unexpected error: {e}")
-                    continue
+        logger.info("Executing plan: %s", self.plan_file)
+        with open(self.plan_file, 'rb') as f:
+            data = f.read()
+        # Only \n ends a line; the per-line strip() drops any \r
+        steps = self._compile_plan(data.decode('utf-8').split('\n'))
+
+        for lineno, handler, args in steps:
+            try:
+                handler(self, *args)
+            except OperationError as e:
+                logger.error("Error encountered: %s", e)
+                continue
+            except Exception as e:
+                # Only pay for the traceback when someone is looking at debug output
+                logger.error("Unexpected error on line %d: %s", lineno, e,
+                             exc_info=logger.isEnabledFor(logging.DEBUG))
+                continue
+
+    def _compile_plan(self, lines):
+        """Parse and validate every plan line up front into (lineno, handler, args) steps.
+
+        Handlers are the plain functions from _DISPATCH and take self as their first argument.
+        """
+        lookup = self._DISPATCH.get
+        parse = _parse_plan_line
+        steps = []
+        append = steps.append
+
+        for lineno, line in enumerate(lines, 1):
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            try:
+                cmd, args = parse(line)
+            except OperationError as e:
+                # Compilation runs before anything executes, so one bad line must not sink the plan
+                logger.error("Error encountered on line %d: %s", lineno, e)
+                continue
+
+            entry = lookup(cmd)
+            if entry is None:
+                logger.error("Error encountered: Unknown command: %s", cmd)
+                continue
+            handler, argc = entry
+            if len(args) != argc:
+                logger.error("Error encountered: Invalid %s syntax. Usage: %s", cmd, PLAN_USAGE[cmd])
+                continue
+            append((lineno, handler, args))
+        return steps
 
     def save_rollback_info(self):
-        with open(self.rollback_file, 'w', encoding='utf-8') as f:
-            json.dump(self.rollback_commands, f)
-        logging.info(f"Rollback information saved to {self.rollback_file}")
+        with open(self.rollback_file, 'wb') as f:
+            f.write(orjson.dumps({"op": self._op.tolist(), "a1": self._a1, "a2": self._a2}))
+        logger.info("Rollback information saved to %s", self.rollback_file)
 
     def load_rollback_info(self):
         if not os.path.isfile(self.rollback_file):
             raise OperationError("No rollback information file found.")
-        with open(self.rollback_file, 'r', encoding='utf-8') as f:
-            self.rollback_commands = json.load(f)
+        with open(self.rollback_file, 'rb') as f:
+            data = orjson.loads(f.read())
+        # Filled in place so the bound column appends keep pointing at the live columns
+        del self._op[:]
+        self._op.extend(data["op"])
+        self._a1[:] = data["a1"]
+        self._a2[:] = data["a2"]
+
+    def _undo_rmdir(self, dir_rel, _unused):
+        dir_path = self._abs(dir_rel)
+        # Let rmdir report emptiness itself instead of listing the directory first
+        try:
+            os.rmdir(dir_path)
+        except OSError as e:
+            if e.errno in (errno.ENOTEMPTY, errno.EEXIST):
+                logger.warning("Directory not empty during rollback: %s, skipping removal.", dir_path)
+            elif e.errno not in (errno.ENOENT, errno.ENOTDIR):
+                raise
+        else:
+            logger.info("Removing directory: %s", dir_path)
+
+    def _undo_move(self, src_rel, dst_rel):
+        src_path = self._abs(src_rel)
+        dst_path = self._abs(dst_rel)
+        if self._is_within_desktop(dst_path):
+            logger.info("Rollback MOVE: %s -> %s", src_path, dst_path)
+            try:
+                _replace(src_path, dst_path)
+            except FileNotFoundError:
+                # ENOENT also covers a missing destination parent; only a missing source is skippable
+                if os.path.lexists(src_path):
+                    raise
+                logger.warning("Rollback MOVE source missing: %s, skipping.", src_path)
+
+    def _undo_rename(self, old_rel, new_rel):
+        old_path = self._abs(old_rel)
+        new_path = self._abs(new_rel)
+        logger.info("Rollback RENAME: %s -> %s", old_path, new_path)
+        try:
+            os.rename(old_path, new_path)
+        except FileNotFoundError:
+            if os.path.lexists(old_path):
+                raise
+            logger.warning("Rollback RENAME source missing: %s, skipping.", old_path)
 
     def rollback(self):
-        logging.info("Starting rollback...")
-        for cmd_tuple in reversed(self.rollback_commands):
-            cmd = cmd_tuple[0]
-            if cmd == "RMDIR":
-                dir_rel = cmd_tuple[1]
-                dir_path = os.path.join(self.desktop_dir, dir_rel)
-                if os.path.isdir(dir_path):
-                    if len(os.listdir(dir_path)) == 0:
-                        logging.info(f"Removing directory: {dir_path}")
-                        os.rmdir(dir_path)
-                    else:
-                        logging.warning(f"Directory not empty during rollback: {dir_path}, skipping removal.")
-            elif cmd == "MOVE":
-                src_rel = cmd_tuple[1]
-                dst_rel = cmd_tuple[2]
-                src_path = os.path.join(self.desktop_dir, src_rel)
-                dst_path = os.path.join(self.desktop_dir, dst_rel)
-                if os.path.exists(src_path) and self._is_within_desktop(dst_path):
-                    logging.info(f"Rollback MOVE: {src_path} -> {dst_path}")
-                    shutil.move(src_path, dst_path)
-            elif cmd == "RENAME":
-                old_rel = cmd_tuple[1]
-                new_rel = cmd_tuple[2]
-                old_path = os.path.join(self.desktop_dir, old_rel)
-                new_path = os.path.join(self.desktop_dir, new_rel)
-                if os.path.exists(old_path):
-                    logging.info(f"Rollback RENAME: {old_path} -> {new_path}")
-                    os.rename(old_path, new_path)
-        logging.info("Rollback completed.")
-
-        self.rollback_commands.clear()
+        logger.info("Starting rollback...")
+        # Indexed by opcode: OP_RMDIR, OP_MOVE, OP_RENAME
+        undo = (self._undo_rmdir, self._undo_move, self._undo_rename)
+        ops = self._op
+        a1 = self._a1
+        a2 = self._a2
+        for i in range(len(ops) - 1, -1, -1):
+            undo[ops[i]](a1[i], a2[i])
+        logger.info("Rollback completed.")
+
+        del self._op[:]
+        self._a1.clear()
+        self._a2.clear()
         if os.path.exists(self.rollback_file):
             os.remove(self.rollback_file)
-            logging.info(f"Removed rollback info file: {self.rollback_file}")
+            logger.info("Removed rollback info file: %s", self.rollback_file)
 
     def plan_mode(self):
-        try:
-            # Adjust the find command to print .app directories but not their internal contents.
-            find_command = [
-                "find", self.desktop_dir,
-                "(",
-                    "-type", "d", "-name", "*.app", "-print", "-prune",
-                ")", "-o", "-print"
-            ]
-
-            result = subprocess.check_output(find_command, universal_newlines=True)
-        except subprocess.CalledProcessError as e:
-            raise OperationError(f"Find command failed: {e}")
-
-        all_paths = result.strip().split("\n")
-        # Exclude the desktop directory itself from the list
-        all_paths = [p for p in all_paths if p != self.desktop_dir]
-
-        listing_info = []
-        for path in all_paths:
-            rel_path = os.path.relpath(path, self.desktop_dir)
-            if os.path.isdir(path):
-                listing_info.append(f"[DIR] {rel_path}")
-            else:
-                file_info = f"[FILE] {rel_path}"
-                listing_info.append(file_info)
-
-        listing_str = "\n".join(listing_info)
-        prompt = f"""
+        prompt_head = f"""
     Below is a list of all files and directories in the {self.desktop_dir} directory.
     For each file, only the file name and path are included.
 
@@ -211,14 +378,32 @@ class PlanExecutor:
     The goal is to make the desktop structure more organized.
 
     Here is the list of files and directories:
-    {listing_str}
+    """
+        prompt_tail = """
 
     After completing, please output the contents of your `.plan` file below.
     """
 
+        # Header, listing and footer all go into one pre-encoded buffer
+        buf = io.BytesIO()
+        w = buf.write
+        w(prompt_head.encode('utf-8'))
+        skip = len(self._prefix)
+        # Entries are newline-separated, not terminated, so an empty desktop adds nothing
+        sep = b""
+        try:
+            for path, is_dir in _walk_parallel(self.desktop_dir):
+                w(sep)
+                w(b"[DIR] " if is_dir else b"[FILE] ")
+                w(path[skip:].encode('utf-8'))
+                sep = b"\n"
+        except OSError as e:
+            raise OperationError(f"Listing desktop directory failed: {e}")
+        w(prompt_tail.encode('utf-8'))
+
         prompt_file = f"{self.plan_file}.prompt"
-        with open(prompt_file, 'w', encoding='utf-8') as f:
-            f.write(prompt)
+        with open(prompt_file, 'wb') as f:
+            f.write(buf.getvalue())
         print(f"Prompt saved to {prompt_file}. Please upload this file to ChatGPT for further instructions.")
 
 def main():
@@ -237,10 +422,10 @@ def main():
         try:
             executor.plan_mode()
         except OperationError as e:
-            logging.error(f"Error in plan mode: {e}")
+            logger.error("Error in plan mode: %s", e)
             sys.exit(1)
         except Exception as e:
-            logging.exception(f"Unexpected error in plan mode: {e}")
+            logger.exception("Unexpected error in plan mode: %s", e)
             sys.exit(1)
 
     elif args.mode == "execute":
@@ -252,26 +437,26 @@ def main():
                 # User confirmed changes, remove rollback file
                 if os.path.exists(executor.rollback_file):
                     os.remove(executor.rollback_file)
-                    logging.info("Changes confirmed. Rollback information removed.")
+                    logger.info("Changes confirmed. Rollback information removed.")
                 print("Changes have been confirmed.")
             else:
                 # User did not confirm, perform rollback
-                logging.info("User declined changes, performing rollback.")
+                logger.info("User declined changes, performing rollback.")
                 executor.load_rollback_info()
                 executor.rollback()
                 print("Changes rolled back.")
 
         except OperationError as e:
-            logging.error(f"Error encountered: {e}")
+            logger.error("Error encountered: %s", e)
             # Encountered error, perform rollback
-            # if executor.rollback_commands:
-            #     logging.info("Attempting to rollback due to error...")
+            # if executor._op:
+            #     logger.info("Attempting to rollback due to error...")
             #     executor.rollback()
             # sys.exit(1)
         except Exception as e:
-            logging.exception(f"Unexpected error: {e}")
-            # if executor.rollback_commands:
-            #     logging.info("Attempting to rollback due to unexpected error...")
+            logger.exception("Unexpected error: %s", e)
+            # if executor._op:
+            #     logger.info("Attempting to rollback due to unexpected error...")
             #     executor.rollback()
             # sys.exit(1)
 